@@ -1,11 +1,16 @@
 import streamlit as st
 from pathlib import Path
 import joblib
-from sklearn.pipeline import Pipeline
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.neural_network import MLPClassifier
-import pandas as pd
+import numpy as np
+import math
+import queue
+import re
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+from uuid import uuid4
 
 # ==== PAGE CONFIG & CSS ====
 st.set_page_config(page_title="Bộ lọc Email Spam – MLP", page_icon="🧠", layout="centered")
@@ -23,23 +28,308 @@ CUSTOM_CSS = """
 .tips li{margin-bottom:.25rem}
 </style>
 """
-st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
+# Rút gọn CSS một lần cho cả process. Phần tử tạo trong hàm cache được Streamlit
+# phát lại ở mỗi rerun (không phát lại thì trang mất CSS).
+@st.cache_resource(show_spinner=False)
+def _inject_css():
+    st.markdown(re.sub(r"\s*\n\s*", "", CUSTOM_CSS), unsafe_allow_html=True)
+    return True
+
+_inject_css()
 
 st.title("🧠 Bộ lọc Email Spam – MLP (nơ-ron nhẹ)")
 st.caption("TF-IDF (char 3–5 gram) + MLPClassifier • Tối ưu cho tiếng Việt • UI đẹp & nhanh")
 
+# ==== ONNX RUNTIME ====
+# CountVectorizer(analyzer="char") gộp mỗi chuỗi ≥2 khoảng trắng thành một dấu cách
+# trước khi cắt n-gram; Tokenizer của graph ONNX thì không → phải gộp trước khi chạy.
+_WHITE_SPACES = re.compile(r"\s\s+")  # giống CountVectorizer._white_spaces
+
+# Bọc InferenceSession; decision_function trả logit lớp spam như ModelWrapper.
+# InferenceSession.run an toàn đa luồng → không cần khoá.
+class OnnxModel:
+    def __init__(self, onx):
+        import onnxruntime as ort
+        self.sess = ort.InferenceSession(onx, providers=["CPUExecutionProvider"])
+        self.version = uuid4().hex  # định danh lần load, đưa vào khoá cache điểm
+
+    def _inputs(self, texts):
+        return {"input": np.asarray([_WHITE_SPACES.sub(" ", t) for t in texts], dtype=object)}
+
+    # logit trước sigmoid (output "logit" thêm lúc export)
+    def decision_function(self, texts):
+        return self.sess.run(["logit"], self._inputs(texts))[0].ravel()
+
+
+# ==== NUMBA ====
+# Kernel forward cho MLP 2 lớp ẩn ReLU (D→128→64→1): lớp 1 cộng dồn các hàng W1 theo
+# vị trí khác 0 của vector TF-IDF thưa (O(nnz·128) thay vì O(D·128)), lớp 2–3 là dot
+# trên vector float32. numba là tuỳ chọn (requirements-extra.txt): None nếu không có
+# → dùng forward numpy. Chỉ chạy khi model.pkl dùng backend sklearn (không có ONNX).
+@st.cache_resource(show_spinner=False)
+def mlp_kernel():
+    try:
+        from numba import njit
+    except ImportError:
+        return None
+
+    @njit(cache=True, fastmath=True)
+    def forward(indptr, indices, data, W1, b1, W2, b2, W3, b3):
+        n = indptr.shape[0] - 1
+        z = np.empty(n, dtype=np.float32)
+        for i in range(n):
+            h1 = b1.copy()
+            for j in range(indptr[i], indptr[i + 1]):
+                v = data[j]
+                row = indices[j]
+                for k in range(h1.shape[0]):
+                    h1[k] += v * W1[row, k]
+            for k in range(h1.shape[0]):
+                h1[k] = max(h1[k], 0)
+            h2 = h1 @ W2 + b2
+            for k in range(h2.shape[0]):
+                h2[k] = max(h2[k], 0)
+            z[i] = (h2 @ W3 + b3)[0]
+        return z
+
+    return forward
+
+
+# ==== AHO-CORASICK ====
+# Thay cho TfidfVectorizer(analyzer="char").transform: nạp toàn bộ n-gram của vocabulary_
+# vào một automaton Aho-Corasick, quét email một lần để đếm, rồi nhân idf_ và chuẩn hoá
+# l2 như sklearn. Chỉ dùng khi vectorizer có vocabulary (HashingVectorizer thì không) và
+# backend là sklearn; pyahocorasick là tuỳ chọn (requirements-extra.txt).
+class AhoTfidf:
+    def __init__(self, vec):
+        import ahocorasick
+        self.ah = ahocorasick.Automaton()
+        for gram, idx in vec.vocabulary_.items():
+            self.ah.add_word(gram, idx)
+        self.ah.make_automaton()
+        self.pre = vec.build_preprocessor()  # lowercase / strip_accents
+        self.idf = vec.idf_.astype(np.float32)
+        self.sublinear_tf = vec.sublinear_tf
+        self.norm = vec.norm
+
+    @staticmethod
+    def supports(vec):
+        return (getattr(vec, "analyzer", None) == "char" and hasattr(vec, "vocabulary_")
+                and getattr(vec, "use_idf", False) and not vec.binary
+                and vec.input == "content" and vec.norm in ("l2", None))
+
+    def transform(self, texts):
+        from scipy.sparse import csr_matrix
+        indptr, indices, data = [0], [], []
+        for text in texts:
+            doc = _WHITE_SPACES.sub(" ", self.pre(text))
+            hits = np.fromiter((idx for _, idx in self.ah.iter(doc)), dtype=np.int32)
+            cols, counts = np.unique(hits, return_counts=True)
+            tf = counts.astype(np.float32)
+            if self.sublinear_tf:
+                tf = np.log(tf) + 1
+            w = tf * self.idf[cols]
+            if self.norm == "l2" and w.size:
+                w /= np.sqrt(np.dot(w, w))
+            indices.append(cols)
+            data.append(w)
+            indptr.append(indptr[-1] + cols.size)
+        return csr_matrix(
+            (np.concatenate(data) if data else np.empty(0, np.float32),
+             np.concatenate(indices) if indices else np.empty(0, np.int32), indptr),
+            shape=(len(texts), self.idf.size))
+
+
+# ==== SKLEARN ====
+# Hàm kích hoạt lớp ẩn của MLPClassifier (tham số activation), chạy tại chỗ trên mảng
+def _inplace_logistic(a):
+    np.negative(a, out=a)
+    with np.errstate(over="ignore"):  # exp tràn → inf → 1/(1+inf) = 0, đúng giới hạn
+        np.exp(a, out=a)
+    a += 1
+    np.reciprocal(a, out=a)
+
+HIDDEN_ACTIVATIONS = {
+    "identity": lambda a: None,
+    "logistic": _inplace_logistic,
+    "tanh": lambda a: np.tanh(a, out=a),
+    "relu": lambda a: np.maximum(a, 0, out=a),
+}
+
+# Pipeline dùng chung giữa các phiên (cache_resource) nhưng sklearn không cam kết
+# an toàn đa luồng → khoá. Trọng số được tách một lần lúc load; forward MLP tự viết
+# (sparse @ W1 → ReLU → ... → logit) bỏ qua validate / kiểm tra feature name của
+# Pipeline và MLPClassifier ở mỗi request.
+class ModelWrapper:
+    def __init__(self, m):
+        self.m = m
+        self.version = uuid4().hex  # định danh lần load, đưa vào khoá cache điểm
+        self.lock = threading.Lock()
+        self.vec = [step for _, step in m.steps[:-1]]  # TF-IDF, hoặc Hashing + TF-IDF
+        if len(self.vec) == 1 and AhoTfidf.supports(self.vec[0]):
+            try:
+                self.vec = [AhoTfidf(self.vec[0])]
+            except ImportError:
+                pass  # không có pyahocorasick → giữ transform của sklearn
+        self.clf = m[-1]
+        if hasattr(self.clf, "coefs_"):  # MLP
+            self.W, self.b = self.clf.coefs_, self.clf.intercepts_
+            self.act = HIDDEN_ACTIVATIONS[self.clf.activation]
+        else:  # tuyến tính (SGDClassifier): không có lớp ẩn, chỉ một tích thưa x·w + b
+            self.W, self.b = [self.clf.coef_.T], [self.clf.intercept_]
+            self.act = None
+        self.kernel = None
+        if getattr(self.clf, "activation", None) == "relu" and len(self.W) == 3:
+            self.kernel = mlp_kernel()
+        if self.kernel is not None:
+            self.params = []
+            for W, b in zip(self.W, self.b):
+                self.params += [np.ascontiguousarray(W, dtype=np.float32),
+                                np.ascontiguousarray(b, dtype=np.float32)]
+            try:
+                self.decision_function([""])  # biên dịch JIT ngay lúc load, không tính vào request đầu
+            except Exception:
+                self.kernel = None  # numba không biên dịch / ghi cache được → forward numpy
+
+    def transform(self, texts):
+        X = texts
+        for step in self.vec:
+            X = step.transform(X)
+        return X
+
+    # MLPClassifier không có decision_function: dừng trước hàm kích hoạt đầu ra
+    # (logistic) → logit của lớp spam. Với mô hình tuyến tính vòng lớp ẩn rỗng.
+    def decision_function(self, texts):
+        with self.lock:
+            a = self.transform(texts)
+            if self.kernel is not None:
+                a = a.tocsr()
+                return self.kernel(a.indptr, a.indices, a.data, *self.params)
+            for W, b in zip(self.W[:-1], self.b[:-1]):
+                a = a @ W + b
+                self.act(a)  # kích hoạt tại chỗ
+            return (a @ self.W[-1] + self.b[-1]).ravel()
+
+
+# Sigmoid đầu ra: lần ngược từ output "probabilities", lấy Sigmoid gần nhất. Không lấy
+# Sigmoid đầu tiên trong graph vì MLP activation="logistic" cũng có Sigmoid ở lớp ẩn.
+def output_sigmoid(graph, output):
+    producer = {o: n for n in graph.node for o in n.output}
+    frontier, seen = [output], set()
+    while frontier:
+        node = producer.get(frontier.pop(0))
+        if node is None or id(node) in seen:
+            continue
+        if node.op_type == "Sigmoid":
+            return node
+        seen.add(id(node))
+        frontier.extend(node.input)
+    raise ValueError(f"không tìm thấy Sigmoid trước output {output!r}")
+
+
+# Chuyển Pipeline (TF-IDF + MLP) sang ONNX một lần, phục vụ qua onnxruntime.
+# Giữ trong bộ nhớ (bytes): không ghi file vào thư mục app → không tranh chấp giữa các
+# worker, chạy được cả khi thư mục chỉ đọc.
+def export_onnx(model):
+    from onnx import TensorProto, helper
+    from skl2onnx import convert_sklearn
+    from skl2onnx.common.data_types import StringTensorType
+
+    onx = convert_sklearn(
+        model, initial_types=[("input", StringTensorType([None]))], target_opset=15,
+        options={id(model.steps[-1][1]): {"zipmap": False}},
+    )
+    # StringNormalizer mặc định đòi locale en_US.UTF-8, nhiều container không có
+    for node in onx.graph.node:
+        if node.op_type == "StringNormalizer":
+            node.attribute.append(helper.make_attribute("locale", "C.UTF-8"))
+    # xuất thêm logit (đầu vào của Sigmoid) để so ngưỡng trong không gian logit
+    sigmoid = output_sigmoid(onx.graph, "probabilities")
+    onx.graph.node.append(helper.make_node("Identity", [sigmoid.input[0]], ["logit"]))
+    onx.graph.output.append(helper.make_tensor_value_info("logit", TensorProto.FLOAT, [None, 1]))
+    return onx.SerializeToString()
+
+
+# Lượng tử hoá động trọng số MLP sang INT8 (MatMulInteger), độ lệch xác suất ~1e-3.
+# quantize_dynamic chỉ nhận đường dẫn → làm trong thư mục tạm riêng của process.
+def quantize_onnx(onx):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    with tempfile.TemporaryDirectory() as d:
+        src, out = Path(d, "model.onnx"), Path(d, "model.int8.onnx")
+        src.write_bytes(onx)
+        quantize_dynamic(src, out, weight_type=QuantType.QInt8)
+        return out.read_bytes()
+
+
+# float32 xuyên suốt: vectorizer ra float32, trọng số MLP float32 → SGEMM thay vì DGEMM
+def to_float32(model):
+    for _, step in model.steps[:-1]:
+        if "dtype" in step.get_params():
+            step.set_params(dtype=np.float32)
+    clf = model[-1]
+    if hasattr(clf, "coefs_"):  # MLP
+        clf.coefs_ = [W.astype(np.float32, copy=False) for W in clf.coefs_]
+        clf.intercepts_ = [b.astype(np.float32, copy=False) for b in clf.intercepts_]
+    else:  # mô hình tuyến tính (SGDClassifier)
+        clf.coef_ = clf.coef_.astype(np.float32, copy=False)
+        clf.intercept_ = clf.intercept_.astype(np.float32, copy=False)
+    return model
+
+
+# Email mẫu (nhiều dòng, \r\n, khoảng trắng liền, chữ hoa có dấu) để so graph ONNX với
+# Pipeline gốc trước khi dùng; lệch quá atol (INT8 chỉ lệch ~1e-3) → không dùng ONNX.
+PARITY_PROBES = [
+    "Chúc mừng trúng iPhone 15, xác nhận tại đây",
+    "click\n\nhere now",
+    "Chào anh,\r\nEm gửi báo cáo",
+    "HELLO   World\n\nclick  here   NOW!!!",
+    "Lịch họp\ndự án\tlúc 9h",
+]
+
+def check_parity(onnx_model, model, atol=1e-2):
+    from scipy.special import expit
+    ref = model.predict_proba(PARITY_PROBES)[:, 1]
+    got = expit(onnx_model.decision_function(PARITY_PROBES))
+    if not np.allclose(got, ref, atol=atol):
+        raise ValueError(f"ONNX lệch sklearn: {np.abs(got - ref).max():.4f}")
+    return onnx_model
+
+
+def to_runtime(model, source):
+    model = to_float32(model)
+    try:
+        onx = export_onnx(model)
+        try:
+            return check_parity(OnnxModel(quantize_onnx(onx)), model), f"{source} • ONNX INT8"
+        except Exception as e:
+            # không lượng tử hoá được / INT8 lệch → giữ trọng số float
+            st.warning(f"Không dùng được ONNX INT8 ({e}). Sẽ dùng ONNX float.")
+            return check_parity(OnnxModel(onx), model), f"{source} • ONNX Runtime"
+    except Exception as e:
+        # thiếu skl2onnx/onnxruntime hoặc pipeline không convert được → chạy sklearn
+        st.warning(f"Không dùng được ONNX Runtime ({e}). Sẽ chạy sklearn.")
+        return ModelWrapper(model), f"{source} • sklearn"
+
+
 # ==== LOAD MODEL (có Fallback) ====
 @st.cache_resource(show_spinner=False)
 def load_or_build_model():
     p = Path("model.pkl")
     if p.exists():
         try:
-            model = joblib.load(p)
-            return model, "model.pkl (đã huấn luyện)"
+            # mmap: mảng numpy (idf_, coefs_) được map lười từ file, không copy lên heap.
+            # Cần model.pkl không nén, trọng số đã ép float32 (nếu không to_float32 sẽ copy) → xem scripts/resave_model.py
+            model = joblib.load(p, mmap_mode="r")
+            return to_runtime(model, "model.pkl (đã huấn luyện)")
         except Exception as e:
             st.warning(f"Không load được model.pkl ({e}). Sẽ dùng model tạm.")
 
-    # Fallback mini model (đủ chạy demo)
+    # Fallback mini model (đủ chạy demo); import sklearn ở đây vì chỉ nhánh này cần
+    from sklearn.pipeline import Pipeline
+    from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+    from sklearn.linear_model import SGDClassifier
+
     texts = [
         "Nhận quà tặng khủng, bấm link để nhận thưởng ngay",
         "Chúc mừng trúng iPhone 15, xác nhận tại đây",
@@ -51,20 +341,154 @@ def load_or_build_model():
         "Chúc mừng bạn đã trúng tuyển, vui lòng xác nhận thời gian",
     ]
     labels = [1,1,1,1,0,0,0,0]
+    # Hashing thay cho từ điển vocabulary: transform không trạng thái, không tra dict.
+    # Logistic regression (SGD, log_loss): trọng số chỉ là một vector n_features,
+    # chấm một email là một tích vô hướng thưa O(nnz) thay vì GEMV qua lớp ẩn 128.
     model = Pipeline([
-        ("tfidf", TfidfVectorizer(analyzer="char", ngram_range=(3,5))),
-        ("mlp",  MLPClassifier(hidden_layer_sizes=(128,64), activation="relu",
-                                learning_rate_init=1e-3, alpha=1e-4,
-                                max_iter=80, random_state=42))
+        ("hv", HashingVectorizer(analyzer="char", ngram_range=(3,5), n_features=2**18,
+                                 alternate_sign=False, norm=None, dtype=np.float32)),
+        ("tfidf", TfidfTransformer()),
+        ("clf", SGDClassifier(loss="log_loss", alpha=1e-4, random_state=42))
     ]).fit(texts, labels)
-    return model, "model MLP tạm trong app"
+    return to_runtime(model, "model SGD tạm trong app")
 
 model, model_source = load_or_build_model()
 
+EXAMPLES = {
+    "ham": ("Mời bạn tham dự phỏng vấn",
+            "Chúng tôi mời bạn tham dự phỏng vấn lúc 9h sáng thứ Hai tuần tới."),
+    "spam": ("Trúng thưởng iPhone 15",
+             "Chúc mừng! Nhấn vào link để xác nhận và nhận quà ngay hôm nay."),
+}
+
+# ngưỡng mặc định: xác suất spam ≥ ngưỡng → SPAM
+THRESHOLD = 0.50
+
+# số dòng lịch sử tối đa giữ trong một phiên
+HIST_MAX = 200
+
+# xuống dòng / tab → khoảng trắng cho cột trích đoạn lịch sử
+_NL = str.maketrans({"\n": " ", "\r": " ", "\t": " "})
+
+# TF-IDF char 3–5 gram tốn thời gian tỉ lệ với số ký tự; ~2 KB đầu đã đủ tín hiệu spam.
+# Chỉnh ở sidebar (key "max_chars") nếu model.pkl được huấn luyện trên văn bản dài hơn.
+MAX_CHARS = 2048
+
+def email_text(subject, body):
+    text = (subject + " " + body).strip()
+    return text[:st.session_state.get("max_chars", MAX_CHARS)]
+
+# Chấm nhiều email trong một lần gọi (một GEMM thay vì nhiều GEMV) → logit lớp spam
+def score_batch(_model, texts):
+    return _model.decision_function(list(texts))
+
+# Gom request từ nhiều phiên thành lô: mỗi email vào hàng đợi kèm một Future; luồng nền
+# lấy những email đang chờ sẵn (tối đa max_batch, không đợi thêm) rồi chấm cả lô bằng
+# một lần score_batch và trả kết quả về từng Future. Request lẻ không bị trễ thêm; khi
+# nhiều phiên cùng gửi, các email đến trong lúc một lô đang chạy sẽ vào lô kế tiếp.
+class BatchScorer:
+    def __init__(self, model, max_batch=16):
+        self.model = model
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="scorer")
+
+    def submit(self, text):
+        fut = Future()
+        self.queue.put((text, fut))
+        self.pool.submit(self._drain)
+        return fut
+
+    def _drain(self):
+        try:
+            batch = [self.queue.get_nowait()]
+        except queue.Empty:
+            return  # lô trước đã gom luôn request này
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            z = score_batch(self.model, [text for text, _ in batch])
+        except Exception as e:
+            for _, fut in batch:
+                fut.set_exception(e)
+        else:
+            for (_, fut), zi in zip(batch, z):
+                fut.set_result(float(zi))
+
+# Một BatchScorer (hàng đợi + thread pool) cho mỗi lần load mô hình, dùng chung giữa các
+# phiên; version trong khoá → nạp lại mô hình thì có scorer mới giữ mô hình mới
+@st.cache_resource(show_spinner=False)
+def get_scorer(_model, version):
+    return BatchScorer(_model)
+
+# Nhớ logit theo nội dung email: bấm lại cùng email / đổi ngưỡng không chạy lại mô hình.
+# _model có dấu gạch dưới để Streamlit không hash đối tượng mô hình; version (đổi mỗi
+# lần load mô hình) nằm trong khoá để không trả logit của mô hình cũ sau khi nạp lại.
+@st.cache_data(max_entries=512, show_spinner=False)
+def score(_model, version, text):
+    return get_scorer(_model, version).submit(text).result()
+
+# proba ≥ ngưỡng ⇔ logit ≥ logit(ngưỡng) vì sigmoid đơn điệu
+def logit(p):
+    return math.log(p / (1 - p))
+
+# sigmoid ổn định số (math.exp tràn khi |z| lớn); chỉ dùng để hiển thị xác suất
+def sigmoid(z):
+    if z >= 0:
+        return 1 / (1 + math.exp(-z))
+    e = math.exp(z)
+    return e / (1 + e)
+
+# CSV lịch sử chỉ dựng lại khi lịch sử đổi (hist_key tăng sau mỗi dòng mới)
+@st.cache_data(max_entries=64, show_spinner=False)
+def _hist_csv(hist_key, _df):
+    return _df.to_csv(index=False).encode("utf-8")
+
+# Nội dung email đổi → bỏ kết quả cũ, không để thẻ kết quả nằm dưới email khác
+def clear_result():
+    st.session_state.pop("last_z", None)
+
+# Callback chạy trước script nên được phép ghi vào key của widget;
+# chấm sẵn ví dụ để lần bấm "Kiểm tra Spam" kế tiếp lấy ngay từ cache.
+def fill_example(kind):
+    clear_result()
+    subject, body = EXAMPLES[kind]
+    st.session_state["subject"] = subject
+    st.session_state["body"] = body
+    st.session_state["example_filled"] = True
+    score(model, model.version, email_text(subject, body))
+
+# Thẻ kết quả + thanh ngưỡng trong một fragment: kéo ngưỡng chỉ chạy lại hàm này
+# (so logit đã lưu với ngưỡng mới, vẽ lại thẻ), không chạy lại cả script.
+@st.fragment
+def result_card():
+    card = st.container()
+    threshold = st.slider("Ngưỡng phân loại", 0.1, 0.9, THRESHOLD, 0.05, key="threshold",
+                          help="≥ ngưỡng → SPAM")
+    z = st.session_state.get("last_z")
+    if z is None:
+        return
+    is_spam = z >= logit(threshold)
+    label = "🚨 SPAM" if is_spam else "✅ Không phải SPAM"
+    with card:
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        st.markdown(f"<div class='kq'>{label}</div>", unsafe_allow_html=True)
+        st.markdown(
+            f"<div class='small mono'>Xác suất spam: {sigmoid(z):.3f} • Ngưỡng: {threshold:.2f}</div>",
+            unsafe_allow_html=True
+        )
+        badge = "badge-spam" if is_spam else "badge-ok"
+        st.markdown(f"<div class='badge {badge}'>Kết luận</div>", unsafe_allow_html=True)
+        st.markdown("</div>", unsafe_allow_html=True)
+
 # ==== SIDEBAR ====
 with st.sidebar:
     st.subheader("⚙️ Cài đặt")
-    threshold = st.slider("Ngưỡng phân loại", 0.1, 0.9, 0.50, 0.05, help="≥ ngưỡng → SPAM")
+    st.slider("Số ký tự tối đa đưa vào mô hình", 512, 8192, MAX_CHARS, 512, key="max_chars",
+              help="Cắt bớt email dài để chấm nhanh hơn")
     st.markdown(f"**Nguồn mô hình:** `{model_source}`")
     st.markdown("---")
     st.markdown("**📘 Hướng dẫn nhanh**")
@@ -83,32 +507,25 @@ tab1, tab2, tab3 = st.tabs(["🔎 Kiểm tra", "✨ Ví dụ nhanh", "📜 Lịc
 with tab1:
     col1, col2 = st.columns([3,1])
     with col1:
-        st.text_input("Tiêu đề Email", key="subject", placeholder="VD: Thông báo phỏng vấn")
-    st.text_area("Nội dung Email", key="body", height=220,
+        st.text_input("Tiêu đề Email", key="subject", placeholder="VD: Thông báo phỏng vấn",
+                      on_change=clear_result)
+    st.text_area("Nội dung Email", key="body", height=220, on_change=clear_result,
                  placeholder="Dán nội dung email tiếng Việt tại đây...")
 
     if st.button("Kiểm tra Spam", use_container_width=True):
         subject = st.session_state.get("subject", "")
         body = st.session_state.get("body", "")
-        text = (subject + " " + body).strip()
+        text = email_text(subject, body)
 
         if not text:
             st.info("Vui lòng nhập ít nhất tiêu đề hoặc nội dung.")
         else:
-            proba = float(model.predict_proba([text])[0, 1])
-            is_spam = proba >= threshold
-            label = "🚨 SPAM" if is_spam else "✅ Không phải SPAM"
-
-            # Thẻ kết quả
-            st.markdown('<div class="card">', unsafe_allow_html=True)
-            st.markdown(f"<div class='kq'>{label}</div>", unsafe_allow_html=True)
-            st.markdown(
-                f"<div class='small mono'>Xác suất spam: {proba:.3f} • Ngưỡng: {threshold:.2f}</div>",
-                unsafe_allow_html=True
-            )
-            badge = "badge-spam" if is_spam else "badge-ok"
-            st.markdown(f"<div class='badge {badge}'>Kết luận</div>", unsafe_allow_html=True)
-            st.markdown("</div>", unsafe_allow_html=True)
+            with st.spinner("Đang chấm..."):
+                z = score(model, model.version, text)
+            st.session_state["last_z"] = z
+            threshold = st.session_state.get("threshold", THRESHOLD)
+            is_spam = z >= logit(threshold)
+            proba = sigmoid(z)
 
             # Lưu lịch sử trong phiên
             row = {
@@ -116,31 +533,42 @@ with tab1:
                 "kq": "SPAM" if is_spam else "Not spam",
                 "proba": round(proba, 3),
                 "subject": subject[:60],
-                "excerpt": body[:80].replace("\n", " ")
+                "excerpt": body[:80].translate(_NL)
             }
-            st.session_state.setdefault("hist", []).insert(0, row)
+            # bấm lại cùng email với cùng ngưỡng thì không ghi trùng
+            if st.session_state.get("last_key") != (text, threshold):
+                st.session_state["last_key"] = (text, threshold)
+                # lịch sử lưu theo cột, mỗi cột là deque giới hạn → appendleft O(1), bộ nhớ có trần
+                hist = st.session_state.setdefault(
+                    "hist", {k: deque(maxlen=HIST_MAX) for k in row})
+                for k, v in row.items():
+                    hist[k].appendleft(v)
+                # (id phiên, phiên bản) → khoá cache cho file CSV tải về
+                sid, ver = st.session_state.get("hist_key", (uuid4().hex, 0))
+                st.session_state["hist_key"] = (sid, ver + 1)
+
+    result_card()
 
 # -- TAB 2: VÍ DỤ NHANH
 with tab2:
     colA, colB = st.columns(2)
     with colA:
-        if st.button("📩 Ví dụ HAM (không spam)", use_container_width=True):
-            st.session_state["subject"] = "Mời bạn tham dự phỏng vấn"
-            st.session_state["body"] = "Chúng tôi mời bạn tham dự phỏng vấn lúc 9h sáng thứ Hai tuần tới."
-            st.success("Đã điền ví dụ vào tab 🔎 Kiểm tra")
+        st.button("📩 Ví dụ HAM (không spam)", use_container_width=True,
+                  on_click=fill_example, args=("ham",))
     with colB:
-        if st.button("🚨 Ví dụ SPAM", use_container_width=True):
-            st.session_state["subject"] = "Trúng thưởng iPhone 15"
-            st.session_state["body"] = "Chúc mừng! Nhấn vào link để xác nhận và nhận quà ngay hôm nay."
-            st.success("Đã điền ví dụ vào tab 🔎 Kiểm tra")
+        st.button("🚨 Ví dụ SPAM", use_container_width=True,
+                  on_click=fill_example, args=("spam",))
+    if st.session_state.pop("example_filled", False):
+        st.success("Đã điền ví dụ vào tab 🔎 Kiểm tra")
 
 # -- TAB 3: LỊCH SỬ
 with tab3:
-    hist = st.session_state.get("hist", [])
-    if hist:
-        df = pd.DataFrame(hist)
+    hist = st.session_state.get("hist")
+    if hist and hist["time"]:
+        import pandas as pd  # chỉ cần khi có lịch sử; bớt thời gian khởi động
+        df = pd.DataFrame({k: list(v) for k, v in hist.items()})
         st.dataframe(df, use_container_width=True, hide_index=True)
-        csv = df.to_csv(index=False).encode("utf-8")
+        csv = _hist_csv(st.session_state["hist_key"], df)
         st.download_button("⬇️ Tải lịch sử CSV", csv, "history.csv", "text/csv")
         st.caption("Lưu tạm trong phiên làm việc này (không lưu ra server).")
     else:
@@ -0,0 +1,35 @@
+# Ghi lại model.pkl không nén để app load bằng joblib.load(..., mmap_mode="r").
+# Trọng số được ép sẵn về float32 (giống to_float32 trong app.py) → lúc load,
+# astype(copy=False) dùng thẳng mảng đã mmap thay vì copy ra bản float32 trên heap.
+# Chạy một lần sau khi huấn luyện / upload model mới:
+#     python scripts/resave_model.py [đường_dẫn_model.pkl]
+import sys
+from pathlib import Path
+
+import joblib
+import numpy as np
+
+
+def to_float32(model):
+    for _, step in model.steps[:-1]:
+        if "dtype" in step.get_params():
+            step.set_params(dtype=np.float32)
+    clf = model[-1]
+    if hasattr(clf, "coefs_"):  # MLP
+        clf.coefs_ = [W.astype(np.float32) for W in clf.coefs_]
+        clf.intercepts_ = [b.astype(np.float32) for b in clf.intercepts_]
+    else:  # mô hình tuyến tính (SGDClassifier)
+        clf.coef_ = clf.coef_.astype(np.float32)
+        clf.intercept_ = clf.intercept_.astype(np.float32)
+    return model
+
+
+def main():
+    p = Path(sys.argv[1] if len(sys.argv) > 1 else "model.pkl")
+    model = to_float32(joblib.load(p))
+    joblib.dump(model, p, compress=0)
+    print(f"Đã ghi lại {p} (không nén, float32, mmap được)")
+
+
+if __name__ == "__main__":
+    main()